@@ -0,0 +1,56 @@
+import os
+import logging
+from typing import List
+
+import fitz
+from docx import Document
+
+logger = logging.getLogger(__name__)
+
+def warm_worker():
+    """Process pool initializer; a spawned worker imports this module to unpickle it, so fitz and docx load once per worker"""
+    logger.debug("Extraction worker ready")
+
+def extract_pdf_text(filepath: str) -> List[dict]:
+    """Extract text from PDF, returns list of {page, text}"""
+    pages = []
+    try:
+        doc = fitz.open(filepath)
+        for i, page in enumerate(doc):
+            text = page.get_text()
+            if text.strip():
+                pages.append({"page": i + 1, "text": text.strip()})
+        doc.close()
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+    return pages
+
+def extract_docx_text(filepath: str) -> List[dict]:
+    """Extract text from DOCX, returns list of {page, text}"""
+    paragraphs = []
+    try:
+        doc = Document(filepath)
+        current_text = []
+        page_num = 1
+        for para in doc.paragraphs:
+            if para.text.strip():
+                current_text.append(para.text.strip())
+                if len("\n".join(current_text)) > 2000:
+                    paragraphs.append({"page": page_num, "text": "\n".join(current_text)})
+                    current_text = []
+                    page_num += 1
+        if current_text:
+            paragraphs.append({"page": page_num, "text": "\n".join(current_text)})
+    except Exception as e:
+        logger.error(f"DOCX extraction error: {e}")
+    return paragraphs
+
+def extract_image_text(filepath: str) -> List[dict]:
+    """Simulate OCR for images"""
+    filename = os.path.basename(filepath)
+    return [{"page": 1, "text": f"[Image content from {filename}] This image contains visual information that has been processed by the OCR engine. In a production system, Tesseract OCR and CLIP would extract detailed text and visual embeddings from this image."}]
+
+def extract_audio_text(filepath: str) -> List[dict]:
+    """Simulate audio transcription"""
+    filename = os.path.basename(filepath)
+    return [{"page": 1, "text": f"[Audio transcript from {filename}] This audio file has been processed by the speech-to-text engine. In a production system, Whisper would provide accurate timestamps and full transcription.", "timestamp": "00:00:00"}]
@@ -3,6 +3,7 @@ from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 import os
 import logging
 import json
@@ -10,16 +11,23 @@ import re
 import math
 import hashlib
 import asyncio
+import heapq
+import time
+import zlib
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from collections import Counter
 
+import numpy as np
 import jwt
 import bcrypt
-import aiofiles
+
+from extractors import extract_pdf_text, extract_docx_text, extract_image_text, extract_audio_text, warm_worker
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,8 +39,14 @@ db = client[os.environ['DB_NAME']]
 
 # LLM key
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', '')
+LLM_PROVIDER = "openai"
+LLM_MODEL = "gpt-4o"
+QUERY_CACHE_TTL = timedelta(hours=4)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'obsidian-rag-secret-key-2024')
 UPLOAD_DIR = ROOT_DIR / 'data'
+REBUILD_BATCH_SIZE = 1000
+CURSOR_BATCH_SIZE = 500
+UPLOAD_READ_SIZE = 1 << 20
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 app = FastAPI()
@@ -41,6 +55,15 @@ api_router = APIRouter(prefix="/api")
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# PDF/DOCX parsing is CPU-bound; run it in worker processes so the event loop stays responsive.
+# Spawn rather than fork: the pool starts lazily inside the running loop, after motor's threads exist.
+# Each fresh worker imports the parsers once at start-up rather than on every file
+extraction_pool = ProcessPoolExecutor(
+    max_workers=os.cpu_count(),
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=warm_worker
+)
+
 # ========== PYDANTIC MODELS ==========
 
 class UserRegister(BaseModel):
@@ -90,11 +113,14 @@ class StatsOut(BaseModel):
 
 # ========== AUTH HELPERS ==========
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# bcrypt is deliberately slow, so it runs on the default thread pool rather than the event loop
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+async def hash_password(password: str) -> str:
+    hashed = await asyncio.to_thread(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+    return hashed.decode('utf-8')
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await asyncio.to_thread(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
 
 def create_token(user_id: str, role: str) -> str:
     payload = {
@@ -148,90 +174,231 @@ async def log_audit(action: str, user_id: str, details: str = ""):
     }
     await db.audit_logs.insert_one(doc)
 
-# ========== TEXT EXTRACTION ==========
-
-def extract_pdf_text(filepath: str) -> List[dict]:
-    """Extract text from PDF, returns list of {page, text}"""
-    import fitz
-    pages = []
-    try:
-        doc = fitz.open(filepath)
-        for i, page in enumerate(doc):
-            text = page.get_text()
-            if text.strip():
-                pages.append({"page": i + 1, "text": text.strip()})
-        doc.close()
-    except Exception as e:
-        logger.error(f"PDF extraction error: {e}")
-    return pages
-
-def extract_docx_text(filepath: str) -> List[dict]:
-    """Extract text from DOCX, returns list of {page, text}"""
-    from docx import Document
-    paragraphs = []
-    try:
-        doc = Document(filepath)
-        current_text = []
-        page_num = 1
-        for para in doc.paragraphs:
-            if para.text.strip():
-                current_text.append(para.text.strip())
-                if len("\n".join(current_text)) > 2000:
-                    paragraphs.append({"page": page_num, "text": "\n".join(current_text)})
-                    current_text = []
-                    page_num += 1
-        if current_text:
-            paragraphs.append({"page": page_num, "text": "\n".join(current_text)})
-    except Exception as e:
-        logger.error(f"DOCX extraction error: {e}")
-    return paragraphs
+# Strong references to in-flight audit writes; the event loop only keeps weak ones
+audit_tasks = set()
 
-def extract_image_text(filepath: str) -> List[dict]:
-    """Simulate OCR for images"""
-    filename = os.path.basename(filepath)
-    return [{"page": 1, "text": f"[Image content from {filename}] This image contains visual information that has been processed by the OCR engine. In a production system, Tesseract OCR and CLIP would extract detailed text and visual embeddings from this image."}]
+def _audit_done(task: asyncio.Task):
+    audit_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Audit log error: {task.exception()}")
 
-def extract_audio_text(filepath: str) -> List[dict]:
-    """Simulate audio transcription"""
-    filename = os.path.basename(filepath)
-    return [{"page": 1, "text": f"[Audio transcript from {filename}] This audio file has been processed by the speech-to-text engine. In a production system, Whisper would provide accurate timestamps and full transcription.", "timestamp": "00:00:00"}]
+def log_audit_background(action: str, user_id: str, details: str = ""):
+    """Schedule an audit write without holding up the response"""
+    task = asyncio.create_task(log_audit(action, user_id, details))
+    audit_tasks.add(task)
+    task.add_done_callback(_audit_done)
 
 # ========== CHUNKING ==========
 
 def chunk_text(text: str, chunk_size: int = 600, overlap: int = 100) -> List[str]:
     """Split text into overlapping chunks"""
+    # split() already drops whitespace, so every window is non-empty and needs no strip
     words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk = " ".join(words[start:end])
-        if chunk.strip():
-            chunks.append(chunk.strip())
-        start = end - overlap
-    return chunks if chunks else [text[:2000]] if text.strip() else []
+    step = chunk_size - overlap
+    return [" ".join(words[start:start + chunk_size]) for start in range(0, len(words), step)]
 
 # ========== SIMULATED VECTOR SEARCH ==========
 
+WORD_RE = re.compile(r'\b[a-z]{3,}\b')
+STOP_WORDS = frozenset({'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'can', 'her', 'was', 'one', 'our', 'out', 'has', 'have', 'from', 'this', 'that', 'with', 'they', 'been', 'said', 'each', 'which', 'their', 'will', 'other', 'about', 'many', 'then', 'them', 'these', 'some', 'would', 'make', 'like', 'into', 'could', 'time', 'very', 'when', 'come', 'made', 'after', 'back'})
+
 def compute_keywords(text: str) -> dict:
     """Compute keyword frequency for simple text matching"""
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', text.lower())
-    stop_words = {'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'can', 'her', 'was', 'one', 'our', 'out', 'has', 'have', 'from', 'this', 'that', 'with', 'they', 'been', 'said', 'each', 'which', 'their', 'will', 'other', 'about', 'many', 'then', 'them', 'these', 'some', 'would', 'make', 'like', 'into', 'could', 'time', 'very', 'when', 'come', 'made', 'after', 'back'}
-    words = [w for w in words if w not in stop_words]
-    return dict(Counter(words))
-
-def compute_similarity(query_keywords: dict, chunk_keywords: dict) -> float:
-    """Compute cosine similarity between keyword vectors"""
-    all_keys = set(query_keywords.keys()) | set(chunk_keywords.keys())
-    if not all_keys:
-        return 0.0
-    dot = sum(query_keywords.get(k, 0) * chunk_keywords.get(k, 0) for k in all_keys)
-    mag_q = math.sqrt(sum(v**2 for v in query_keywords.values()))
-    mag_c = math.sqrt(sum(v**2 for v in chunk_keywords.values()))
+    return Counter(w for w in WORD_RE.findall(text.lower()) if w not in STOP_WORDS)
+
+def keyword_norm(keywords: dict) -> float:
+    """Euclidean norm of a keyword frequency vector"""
+    return math.sqrt(sum(v * v for v in keywords.values()))
+
+def compute_similarity(query_keywords: dict, chunk_keywords: dict, mag_q: float, mag_c: float) -> float:
+    """Compute cosine similarity between keyword vectors, given both precomputed norms"""
     if mag_q == 0 or mag_c == 0:
         return 0.0
+    # Terms absent from the query contribute nothing to the dot product
+    dot = sum(v * chunk_keywords.get(k, 0) for k, v in query_keywords.items())
     return dot / (mag_q * mag_c)
 
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+class ChunkIndex:
+    """In-memory inverted keyword index for BM25: per-term posting lists of (chunk row, tf), stored column-major"""
+
+    def __init__(self):
+        self.chunk_ids: List[str] = []
+        self.vocab: dict = {}
+        self.postings_ptr = np.zeros(1, dtype=np.int64)
+        self.posting_rows = np.zeros(0, dtype=np.int32)
+        self.posting_tfs = np.zeros(0, dtype=np.float64)
+        self.doc_lengths = np.zeros(0, dtype=np.float64)
+        self.avgdl = 0.0
+        self.ready = False
+        self._lock = asyncio.Lock()
+        self._generation = 0
+        self._refresh_task = None
+
+    def invalidate(self):
+        """Mark the index stale and schedule one coalesced background rebuild"""
+        # Queries fall back to the text index until a rebuild newer than this call completes
+        self.ready = False
+        self._generation += 1
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_until_current())
+
+    async def _refresh_until_current(self):
+        # Writes that land mid-rebuild bump the generation, so a single extra pass picks them all up
+        try:
+            while not self.ready:
+                await self.refresh()
+        except Exception as e:
+            logger.error(f"Chunk index refresh error: {e}")
+
+    async def refresh(self):
+        """Rebuild the index from the chunks collection"""
+        async with self._lock:
+            generation = self._generation
+            chunk_ids, vocab, indptr, indices, data = [], {}, [0], [], []
+            cursor = db.chunks.find({}, {"_id": 0, "chunk_id": 1, "keywords": 1}).batch_size(CURSOR_BATCH_SIZE)
+            async for chunk in cursor:
+                for term, tf in chunk.get("keywords", {}).items():
+                    indices.append(vocab.setdefault(term, len(vocab)))
+                    data.append(tf)
+                indptr.append(len(indices))
+                chunk_ids.append(chunk["chunk_id"])
+
+            indices = np.asarray(indices, dtype=np.int32)
+            data = np.asarray(data, dtype=np.float64)
+            rows = np.repeat(np.arange(len(chunk_ids), dtype=np.int32), np.diff(indptr))
+            # Regroup the row-major entries by term so each term's postings are one contiguous slice
+            order = np.argsort(indices, kind="stable")
+            self.chunk_ids = chunk_ids
+            self.vocab = vocab
+            self.postings_ptr = np.concatenate(([0], np.cumsum(np.bincount(indices, minlength=len(vocab)))))
+            self.posting_rows = rows[order]
+            self.posting_tfs = data[order]
+            self.doc_lengths = np.bincount(rows, weights=data, minlength=len(chunk_ids))
+            self.avgdl = float(self.doc_lengths.mean()) if len(chunk_ids) else 0.0
+            self.ready = self._generation == generation
+        logger.info(f"Chunk index refreshed: {len(chunk_ids)} chunks, {len(vocab)} terms")
+
+    def search(self, query_keywords: dict, top_k: int) -> List[tuple]:
+        """Return up to top_k (score, chunk_id) pairs with a positive BM25 score, best first"""
+        if top_k <= 0:
+            return []
+        n = len(self.chunk_ids)
+        spans = []
+        for term, qtf in query_keywords.items():
+            col = self.vocab.get(term)
+            if col is not None:
+                start, end = self.postings_ptr[col], self.postings_ptr[col + 1]
+                df = end - start
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                spans.append((start, end, qtf * idf))
+        if not spans:
+            return []
+        # Only chunks on a query term's posting list can score above zero
+        rows = np.concatenate([self.posting_rows[a:b] for a, b, _ in spans])
+        tfs = np.concatenate([self.posting_tfs[a:b] for a, b, _ in spans])
+        idfs = np.concatenate([np.full(b - a, w) for a, b, w in spans])
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[rows] / self.avgdl)
+        weights = idfs * tfs * (BM25_K1 + 1) / (tfs + length_norm)
+        candidates, slot = np.unique(rows, return_inverse=True)
+        scores = np.bincount(slot, weights=weights)
+        k = min(top_k, len(candidates))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(float(scores[i]), self.chunk_ids[candidates[i]]) for i in top]
+
+chunk_index = ChunkIndex()
+
+# ========== SEMANTIC QUERY CACHE ==========
+
+# Unlike WORD_RE this keeps short words and contractions, so "not", "no" and "isn't" survive
+QUERY_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+NEGATION_WORDS = frozenset({'not', 'no', 'nor', 'never', 'none', 'nothing', 'neither', 'nobody', 'nowhere', 'without', 'cannot'})
+
+def query_terms(text: str) -> dict:
+    """Term frequencies of a normalized query with no stop-word filtering, used as the cache vector"""
+    return Counter(QUERY_TOKEN_RE.findall(text.lower().replace("\u2019", "'")))
+
+def negations(terms: dict) -> frozenset:
+    """Negation words present in a query's terms"""
+    return frozenset(t for t in terms if t in NEGATION_WORDS or t.endswith("n't"))
+
+class SemanticCache:
+    """Caches (answer, citations) per query, bucketed by random-projection LSH of the query term vector"""
+
+    def __init__(self, num_projections: int = 8, dim: int = 4096, threshold: float = 0.95,
+                 ttl_seconds: int = 3600, max_entries: int = 5000, seed: int = 0):
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.planes = np.random.default_rng(seed).standard_normal((num_projections, dim))
+        self._buckets: dict = {}
+        self._size = 0
+        # Bumped by clear(); a put started before a corpus change carries a stale number and is dropped
+        self.generation = 0
+
+    def _vector(self, query_terms: dict) -> np.ndarray:
+        # Hash terms into a fixed space so the projections stay valid as the vocab grows
+        vec = np.zeros(self.dim)
+        for term, tf in query_terms.items():
+            vec[zlib.crc32(term.encode("utf-8")) % self.dim] += tf
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _key(self, query_terms: dict, vec: np.ndarray, top_k: int) -> tuple:
+        # A negation flips the meaning while barely moving the vector, so it must match exactly
+        return (top_k, negations(query_terms), np.packbits(self.planes @ vec > 0).tobytes())
+
+    def get(self, query_terms: dict, top_k: int):
+        vec = self._vector(query_terms)
+        if not vec.any():
+            return None
+        bucket = self._buckets.get(self._key(query_terms, vec, top_k))
+        if not bucket:
+            return None
+        now = time.monotonic()
+        best_sim, best = self.threshold, None
+        for cached_vec, result, expires_at in bucket:
+            if expires_at > now:
+                sim = float(cached_vec @ vec)
+                if sim >= best_sim:
+                    best_sim, best = sim, result
+        return best
+
+    def put(self, query_terms: dict, top_k: int, result: tuple, generation: int):
+        """Store a result computed while the cache was at the given generation"""
+        vec = self._vector(query_terms)
+        if not vec.any() or generation != self.generation:
+            return
+        if self._size >= self.max_entries:
+            self._evict_expired()
+            if self._size >= self.max_entries:
+                # Capacity reset only; the corpus is unchanged, so in-flight puts stay valid
+                self._buckets.clear()
+                self._size = 0
+        self._buckets.setdefault(self._key(query_terms, vec, top_k), []).append((vec, result, time.monotonic() + self.ttl_seconds))
+        self._size += 1
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in list(self._buckets):
+            live = [entry for entry in self._buckets[key] if entry[2] > now]
+            self._size -= len(self._buckets[key]) - len(live)
+            if live:
+                self._buckets[key] = live
+            else:
+                del self._buckets[key]
+
+    def clear(self):
+        self._buckets.clear()
+        self._size = 0
+        self.generation += 1
+
+semantic_cache = SemanticCache()
+
 # ========== AUTH ROUTES ==========
 
 @api_router.post("/auth/register")
@@ -245,7 +412,7 @@ async def register(data: UserRegister):
         "id": str(uuid.uuid4()),
         "username": data.username,
         "email": data.email,
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "role": "admin" if user_count == 0 else "user",
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -257,7 +424,7 @@ async def register(data: UserRegister):
 @api_router.post("/auth/login")
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
-    if not user or not verify_password(data.password, user["password_hash"]):
+    if not user or not await verify_password(data.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_token(user["id"], user["role"])
     await log_audit("user_login", user["id"], f"User {user['username']} logged in")
@@ -267,6 +434,22 @@ async def login(data: UserLogin):
 async def get_me(user=Depends(auth_dependency)):
     return {"id": user["id"], "username": user["username"], "email": user["email"], "role": user["role"]}
 
+# ========== FILE STORAGE ==========
+
+def save_upload(src, path: str) -> tuple:
+    """Copy an upload to disk in bounded pieces, hashing as we go; returns (size, sha256 hex)"""
+    size = 0
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while True:
+            piece = src.read(UPLOAD_READ_SIZE)
+            if not piece:
+                break
+            digest.update(piece)
+            f.write(piece)
+            size += len(piece)
+    return size, digest.hexdigest()
+
 # ========== UPLOAD ROUTES ==========
 
 @api_router.post("/documents/upload")
@@ -282,17 +465,17 @@ async def upload_document(file: UploadFile = File(...), user=Depends(auth_depend
         raise HTTPException(status_code=400, detail=f"Unsupported file type: .{ext}")
 
     doc_id = str(uuid.uuid4())
+    now_iso = datetime.now(timezone.utc).isoformat()
     filepath = UPLOAD_DIR / f"{doc_id}_{file.filename}"
     
-    content = await file.read()
-    async with aiofiles.open(str(filepath), 'wb') as f:
-        await f.write(content)
+    file_size, sha256 = await asyncio.to_thread(save_upload, file.file, str(filepath))
     
     # Extract text based on type
+    loop = asyncio.get_running_loop()
     if file_type == "pdf":
-        pages = extract_pdf_text(str(filepath))
+        pages = await loop.run_in_executor(extraction_pool, extract_pdf_text, str(filepath))
     elif file_type == "docx":
-        pages = extract_docx_text(str(filepath))
+        pages = await loop.run_in_executor(extraction_pool, extract_docx_text, str(filepath))
     elif file_type == "image":
         pages = extract_image_text(str(filepath))
     elif file_type == "audio":
@@ -300,12 +483,13 @@ async def upload_document(file: UploadFile = File(...), user=Depends(auth_depend
     else:
         pages = []
 
-    # Chunk and store
-    chunks_stored = 0
+    # Chunk and store (one bulk insert instead of a round-trip per chunk)
+    to_insert = []
     for page_data in pages:
         text_chunks = chunk_text(page_data["text"])
-        for i, chunk_text_content in enumerate(text_chunks):
-            chunk = {
+        keywords = [compute_keywords(t) for t in text_chunks]
+        for i, (chunk_text_content, chunk_keywords) in enumerate(zip(text_chunks, keywords)):
+            to_insert.append({
                 "chunk_id": str(uuid.uuid4()),
                 "document_id": doc_id,
                 "text": chunk_text_content,
@@ -313,16 +497,19 @@ async def upload_document(file: UploadFile = File(...), user=Depends(auth_depend
                 "file_type": file_type,
                 "page_number": page_data.get("page"),
                 "timestamp": page_data.get("timestamp"),
-                "keywords": compute_keywords(chunk_text_content),
+                "keywords": chunk_keywords,
+                "norm": keyword_norm(chunk_keywords),
                 "chunk_index": i,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.chunks.insert_one(chunk)
-            chunks_stored += 1
+                "created_at": now_iso
+            })
+    if to_insert:
+        await db.chunks.insert_many(to_insert, ordered=False)
+    chunks_stored = len(to_insert)
 
     # Fallback: if no text extracted, store a metadata chunk
     if chunks_stored == 0:
-        fallback_text = f"Document: {file.filename} (Type: {file_type}, Size: {len(content)} bytes). No text content could be extracted from this file."
+        fallback_text = f"Document: {file.filename} (Type: {file_type}, Size: {file_size} bytes). No text content could be extracted from this file."
+        fallback_keywords = compute_keywords(fallback_text)
         chunk = {
             "chunk_id": str(uuid.uuid4()),
             "document_id": doc_id,
@@ -331,9 +518,10 @@ async def upload_document(file: UploadFile = File(...), user=Depends(auth_depend
             "file_type": file_type,
             "page_number": 1,
             "timestamp": None,
-            "keywords": compute_keywords(fallback_text),
+            "keywords": fallback_keywords,
+            "norm": keyword_norm(fallback_keywords),
             "chunk_index": 0,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": now_iso
         }
         await db.chunks.insert_one(chunk)
         chunks_stored = 1
@@ -343,15 +531,18 @@ async def upload_document(file: UploadFile = File(...), user=Depends(auth_depend
         "id": doc_id,
         "filename": file.filename,
         "file_type": file_type,
-        "file_size": len(content),
+        "file_size": file_size,
+        "sha256": sha256,
         "total_chunks": chunks_stored,
         "status": "indexed" if chunks_stored > 0 else "empty",
         "uploaded_by": user["id"],
         "uploaded_by_name": user["username"],
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "uploaded_at": now_iso
     }
     await db.documents.insert_one(document)
-    await log_audit("document_upload", user["id"], f"Uploaded {file.filename} ({chunks_stored} chunks)")
+    chunk_index.invalidate()
+    semantic_cache.clear()
+    log_audit_background("document_upload", user["id"], f"Uploaded {file.filename} ({chunks_stored} chunks)")
 
     return {
         "id": doc_id,
@@ -374,66 +565,116 @@ async def delete_document(doc_id: str, user=Depends(auth_dependency)):
     
     await db.documents.delete_one({"id": doc_id})
     await db.chunks.delete_many({"document_id": doc_id})
+    chunk_index.invalidate()
+    semantic_cache.clear()
     
     # Delete file from disk
     for f in UPLOAD_DIR.glob(f"{doc_id}_*"):
         f.unlink(missing_ok=True)
     
-    await log_audit("document_delete", user["id"], f"Deleted {doc.get('filename', doc_id)}")
+    log_audit_background("document_delete", user["id"], f"Deleted {doc.get('filename', doc_id)}")
     return {"message": "Document deleted", "id": doc_id}
 
-# ========== QUERY ROUTES ==========
+# ========== RAG PIPELINE ==========
+
+_CITATION_LABEL = r'(?:DOC\s*)?[0-9a-f]{8}'
+# A bracketed or parenthesized list made only of labels: [DOC 1a2b3c4d, DOC 5e6f7a8b], (DOC 1a2b3c4d), [1a2b3c4d]
+CITATION_GROUP_RE = re.compile(rf'[\[(]\s*{_CITATION_LABEL}(?:\s*(?:[,;&]|and)\s*{_CITATION_LABEL})*\s*[\])]', re.IGNORECASE)
+CITATION_LABEL_RE = re.compile(r'\b[0-9a-f]{8}\b', re.IGNORECASE)
+# Any remaining DOC <label> token, wherever it appears in the text
+CITATION_RE = re.compile(r'\bDOC\s*([0-9a-f]{8})\b', re.IGNORECASE)
+
+def chunk_label(chunk_id: str) -> str:
+    """Short, stable label used for a chunk inside the LLM prompt"""
+    return chunk_id[:8]
+
+def renumber_citations(answer: str, index_by_label: dict) -> str:
+    """Rewrite DOC <label> citations from the LLM into the numbered [n] form returned to clients"""
+    def _group(match):
+        indices = [index_by_label.get(label.lower()) for label in CITATION_LABEL_RE.findall(match.group(0))]
+        if not all(indices):
+            # Leave lists with an unknown label to the per-token pass below
+            return match.group(0)
+        return "".join(f"[{index}]" for index in dict.fromkeys(indices))
+
+    def _token(match):
+        index = index_by_label.get(match.group(1).lower())
+        return f"[{index}]" if index else match.group(0)
+    return CITATION_RE.sub(_token, CITATION_GROUP_RE.sub(_group, answer))
+
+async def retrieve_chunks(query: str, query_keywords: dict, top_k: int) -> List[tuple]:
+    """Return up to top_k (score, chunk) pairs with a positive score, best first"""
+    if chunk_index.ready:
+        # Score the query's posting lists in the in-memory index, then fetch only the winners
+        hits = chunk_index.search(query_keywords, top_k)
+        found = await db.chunks.find({"chunk_id": {"$in": [chunk_id for _, chunk_id in hits]}}, {"_id": 0}).to_list(len(hits))
+        by_id = {c["chunk_id"]: c for c in found}
+        return [(score, by_id[chunk_id]) for score, chunk_id in hits if chunk_id in by_id]
+
+    # Index still warming up: let Mongo's text index shortlist candidates, re-rank only those
+    shortlist_size = top_k * 5
+    shortlist = await db.chunks.find(
+        {"$text": {"$search": query}},
+        {"_id": 0, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(shortlist_size).to_list(shortlist_size)
+    mag_q = keyword_norm(query_keywords)
+    scored = [
+        (compute_similarity(query_keywords, c.get("keywords", {}), mag_q, c.get("norm") or keyword_norm(c.get("keywords", {}))), c)
+        for c in shortlist
+    ]
+    return [(score, c) for score, c in heapq.nlargest(top_k, scored, key=lambda x: x[0]) if score > 0]
 
-@api_router.post("/query")
-async def query_rag(data: QueryRequest, user=Depends(auth_dependency)):
-    query_keywords = compute_keywords(data.query)
-    
-    # Get all chunks and compute similarity
-    all_chunks = await db.chunks.find({}, {"_id": 0}).to_list(10000)
+async def answer_query(data: QueryRequest, query_keywords: dict) -> tuple:
+    """Run retrieval and generation, returns (answer, citations, generated_by_llm)"""
+    top_chunks = await retrieve_chunks(data.query, query_keywords, data.top_k)
     
-    scored = []
-    for chunk in all_chunks:
-        score = compute_similarity(query_keywords, chunk.get("keywords", {}))
-        scored.append((score, chunk))
+    # Identical question over identical chunks with the same model gives the same prompt
+    normalized = " ".join(data.query.lower().split())
+    chunk_ids = "|".join(sorted(chunk["chunk_id"] for _, chunk in top_chunks))
+    cache_key = hashlib.sha256(f"{normalized}|{chunk_ids}|{LLM_MODEL}".encode("utf-8")).hexdigest()
+    cached = await db.query_cache.find_one({"_id": cache_key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+    if cached:
+        return cached["answer"], cached["citations"], True
     
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top_chunks = scored[:data.top_k]
-    
-    # Build context
-    context_parts = []
+    # Build citations in score order; the prompt refers to chunks by a stable label instead
     citations = []
+    index_by_label = {}
     for i, (score, chunk) in enumerate(top_chunks):
-        if score > 0:
-            ref_label = f"[{i+1}]"
-            context_parts.append(f"{ref_label} {chunk['text']}")
-            citation = {
-                "index": i + 1,
-                "filename": chunk.get("filename", "Unknown"),
-                "file_type": chunk.get("file_type", "unknown"),
-                "page_number": chunk.get("page_number"),
-                "timestamp": chunk.get("timestamp"),
-                "text_preview": chunk["text"][:200],
-                "score": round(score, 4)
-            }
-            citations.append(citation)
+        index_by_label[chunk_label(chunk["chunk_id"])] = i + 1
+        citation = {
+            "index": i + 1,
+            "filename": chunk.get("filename", "Unknown"),
+            "file_type": chunk.get("file_type", "unknown"),
+            "page_number": chunk.get("page_number"),
+            "timestamp": chunk.get("timestamp"),
+            "text_preview": chunk["text"][:200],
+            "score": round(score, 4)
+        }
+        citations.append(citation)
     
-    context = "\n\n".join(context_parts) if context_parts else "No relevant documents found."
+    # Canonical chunk order and fixed block headers keep the prompt prefix identical across
+    # queries that retrieve the same chunks, so provider-side prefix caching can reuse it
+    blocks = [
+        f"### DOC {chunk_label(chunk['chunk_id'])}\n{chunk['text']}"
+        for _, chunk in sorted(top_chunks, key=lambda x: x[1]["chunk_id"])
+    ]
+    context = "\n\n".join(blocks) if blocks else "No relevant documents found."
     
     # Generate LLM response
-    answer = ""
     try:
         from emergentintegrations.llm.chat import LlmChat, UserMessage
         
-        system_prompt = """You are a secure offline assistant for Project Obsidian. Answer strictly using the provided context. Include numbered citations like [1], [2] etc. referencing the source documents. If the context doesn't contain relevant information, say so clearly. Be precise and professional."""
+        system_prompt = """You are a secure offline assistant for Project Obsidian. Answer strictly using the provided context. Each context block starts with a header like "### DOC 1a2b3c4d". Cite sources by writing the block id in brackets, like [DOC 1a2b3c4d]. If the context doesn't contain relevant information, say so clearly. Be precise and professional."""
         
         chat = LlmChat(
             api_key=EMERGENT_LLM_KEY,
             session_id=f"query-{str(uuid.uuid4())[:8]}",
             system_message=system_prompt
-        ).with_model("openai", "gpt-4o")
+        ).with_model(LLM_PROVIDER, LLM_MODEL)
         
         user_msg = UserMessage(text=f"Context:\n{context}\n\nQuestion: {data.query}")
         answer = await chat.send_message(user_msg)
+        answer = renumber_citations(answer, index_by_label)
     except Exception as e:
         logger.error(f"LLM error: {e}")
         if citations:
@@ -445,6 +686,32 @@ async def query_rag(data: QueryRequest, user=Depends(auth_dependency)):
                 answer += f": {c['text_preview']}...\n\n"
         else:
             answer = "No relevant documents found for your query. Please upload documents first."
+        return answer, citations, False
+    
+    await db.query_cache.update_one(
+        {"_id": cache_key},
+        {"$set": {"answer": answer, "citations": citations, "expires_at": datetime.now(timezone.utc) + QUERY_CACHE_TTL}},
+        upsert=True
+    )
+    return answer, citations, True
+
+# ========== QUERY ROUTES ==========
+
+@api_router.post("/query")
+async def query_rag(data: QueryRequest, user=Depends(auth_dependency)):
+    query_keywords = compute_keywords(data.query)
+    cache_terms = query_terms(data.query)
+    
+    cached = semantic_cache.get(cache_terms, data.top_k)
+    if cached:
+        answer, citations = cached
+    else:
+        # An upload or delete during answer_query clears the cache; the answer must not outlive it
+        generation = semantic_cache.generation
+        answer, citations, generated = await answer_query(data, query_keywords)
+        # Only cache real LLM answers, not the fallback built when the LLM is unavailable
+        if generated:
+            semantic_cache.put(cache_terms, data.top_k, (answer, citations), generation)
     
     # Store query
     query_record = {
@@ -457,7 +724,12 @@ async def query_rag(data: QueryRequest, user=Depends(auth_dependency)):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.queries.insert_one(query_record)
-    await log_audit("query", user["id"], f"Query: {data.query[:100]}")
+    await db.query_daily_counts.update_one(
+        {"_id": query_record["created_at"][:10]},
+        {"$inc": {"count": 1}},
+        upsert=True
+    )
+    log_audit_background("query", user["id"], f"Query: {data.query[:100]}")
     
     return {
         "answer": answer,
@@ -474,32 +746,24 @@ async def query_history(user=Depends(auth_dependency), limit: int = 50):
 
 @api_router.get("/analytics/stats")
 async def get_stats(user=Depends(auth_dependency)):
-    total_docs = await db.documents.count_documents({})
-    total_chunks = await db.chunks.count_documents({})
-    total_queries = await db.queries.count_documents({})
-    total_users = await db.users.count_documents({})
-    
-    # File distribution
     pipeline = [{"$group": {"_id": "$file_type", "count": {"$sum": 1}}}]
-    dist_cursor = db.documents.aggregate(pipeline)
-    distribution = {}
-    async for item in dist_cursor:
-        distribution[item["_id"]] = item["count"]
     
-    # Recent queries
-    recent = await db.queries.find({}, {"_id": 0, "query": 1, "username": 1, "created_at": 1}).sort("created_at", -1).to_list(10)
-    
-    # Query count by date (last 7 days)
-    query_dates_pipeline = [
-        {"$addFields": {"date_str": {"$substr": ["$created_at", 0, 10]}}},
-        {"$group": {"_id": "$date_str", "count": {"$sum": 1}}},
-        {"$sort": {"_id": -1}},
-        {"$limit": 7}
-    ]
-    date_cursor = db.queries.aggregate(query_dates_pipeline)
-    query_by_date = []
-    async for item in date_cursor:
-        query_by_date.append({"date": item["_id"], "count": item["count"]})
+    # Independent reads, issued together so the page waits on the slowest one rather than the sum.
+    # Chunk and query totals are dashboard figures, so the O(1) metadata estimate is enough
+    total_docs, total_chunks, total_queries, total_users, dist_list, recent, daily = await asyncio.gather(
+        db.documents.count_documents({}),
+        db.chunks.estimated_document_count(),
+        db.queries.estimated_document_count(),
+        db.users.count_documents({}),
+        # File distribution
+        db.documents.aggregate(pipeline).to_list(None),
+        # Recent queries
+        db.queries.find({}, {"_id": 0, "query": 1, "username": 1, "created_at": 1}).sort("created_at", -1).to_list(10),
+        # Query count by date (last 7 days), served from the daily rollup
+        db.query_daily_counts.find().sort("_id", -1).to_list(7)
+    )
+    distribution = {item["_id"]: item["count"] for item in dist_list}
+    query_by_date = [{"date": item["_id"], "count": item["count"]} for item in daily]
     
     return {
         "total_documents": total_docs,
@@ -521,17 +785,27 @@ async def get_audit_logs(user=Depends(admin_dependency), limit: int = 100):
 @api_router.post("/admin/rebuild-index")
 async def rebuild_index(user=Depends(admin_dependency)):
     """Rebuild keyword indexes for all chunks"""
-    chunks = await db.chunks.find({}, {"_id": 0}).to_list(50000)
+    # Iterate in batches so recomputing keywords overlaps with fetching the next batch
+    cursor = db.chunks.find({}, {"_id": 0, "chunk_id": 1, "text": 1}).batch_size(CURSOR_BATCH_SIZE)
     updated = 0
-    for chunk in chunks:
+    ops = []
+    async for chunk in cursor:
         new_keywords = compute_keywords(chunk.get("text", ""))
-        await db.chunks.update_one(
+        ops.append(UpdateOne(
             {"chunk_id": chunk["chunk_id"]},
-            {"$set": {"keywords": new_keywords}}
-        )
-        updated += 1
+            {"$set": {"keywords": new_keywords, "norm": keyword_norm(new_keywords)}}
+        ))
+        if len(ops) >= REBUILD_BATCH_SIZE:
+            await db.chunks.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            ops = []
+    if ops:
+        await db.chunks.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    await chunk_index.refresh()
+    semantic_cache.clear()
     
-    await log_audit("rebuild_index", user["id"], f"Rebuilt index for {updated} chunks")
+    log_audit_background("rebuild_index", user["id"], f"Rebuilt index for {updated} chunks")
     return {"message": f"Index rebuilt for {updated} chunks", "total_chunks": updated}
 
 @api_router.get("/admin/users")
@@ -568,10 +842,25 @@ async def startup():
     await db.documents.create_index("id", unique=True)
     await db.chunks.create_index("document_id")
     await db.chunks.create_index("chunk_id", unique=True)
-    await db.queries.create_index("user_id")
+    await db.chunks.create_index([("text", "text")])
+    await db.documents.create_index([("uploaded_at", -1)])
+    await db.queries.create_index([("created_at", -1)])
+    await db.queries.create_index([("user_id", 1), ("created_at", -1)])
     await db.audit_logs.create_index("timestamp")
+    await db.query_cache.create_index("expires_at", expireAfterSeconds=0)
+    # Backfill the per-day query rollup once for databases that predate it
+    if not await db.query_daily_counts.find_one() and await db.queries.find_one():
+        await db.queries.aggregate([
+            {"$group": {"_id": {"$substr": ["$created_at", 0, 10]}, "count": {"$sum": 1}}},
+            {"$merge": {"into": "query_daily_counts", "whenMatched": "replace"}}
+        ]).to_list(None)
+    # Build the in-memory index in the background; queries use the text index until it is ready
+    chunk_index.invalidate()
     logger.info("Project Obsidian API started - indexes created")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Let in-flight audit writes land before the client goes away
+    await asyncio.gather(*audit_tasks, return_exceptions=True)
     client.close()
+    extraction_pool.shutdown(wait=False, cancel_futures=True)
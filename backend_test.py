@@ -1,12 +1,65 @@
 #!/usr/bin/env python3
 
+import ijson
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import os
 import sys
-import json
 import io
+import logging
+from logging.handlers import MemoryHandler
+import time
+import base64
+import threading
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+# Buffer output and write it in batches; errors flush immediately
+logger = logging.getLogger('obsidian_test')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(MemoryHandler(200, flushLevel=logging.ERROR, target=logging.StreamHandler(sys.stdout)))
+
+# Constant request bodies, encoded once instead of on every call
+_LOGIN_INVALID_BODY = orjson.dumps({"email": "invalid@test.com", "password": "wrongpassword"})
+_QUERY_BODY = orjson.dumps({"query": "What information is available in the uploaded documents?", "top_k": 5})
+
+# JWT from the last successful login, reused across runs until it is about to expire
+_TOKEN_CACHE_PATH = Path('/tmp/obsidian_test_token.json')
+
+# Small PDF-like upload fixture, written once and reused by later runs
+_FIXTURE_PDF_PATH = Path('/tmp/obsidian_fixture.pdf')
+if not _FIXTURE_PDF_PATH.exists():
+    _FIXTURE_PDF_PATH.write_bytes(b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\nTest PDF content for RAG system")
+
+# (connect, read): a dead host fails in seconds, a slow endpoint still gets its full budget
+REQUEST_TIMEOUT = (3.05, 27)
+
+def count_json_array(source):
+    """Count the items of a top-level JSON array from a stream; raises ValueError for any other body"""
+    events = ijson.parse(source)
+    _, event, _ = next(events, (None, None, None))
+    if event != 'start_array':
+        raise ValueError(f"expected a JSON array, got {event or 'an empty body'}")
+    # Each item opens with exactly one event at the 'item' prefix; map keys and closers share it
+    return sum(1 for prefix, event, _ in events if prefix == 'item' and event not in ('map_key', 'end_map', 'end_array'))
+
+@dataclass(slots=True)
+class APITestResult:
+    """Outcome of a single API call made by run_test"""
+    name: str
+    method: str
+    endpoint: str
+    expected_status: int
+    actual_status: object
+    success: bool
+    response_data: object = None
+    error: object = None
+
 class ObsidianAPITester:
     def __init__(self, base_url="https://data-vault-ai.preview.emergentagent.com/api"):
         self.base_url = base_url
@@ -15,76 +68,157 @@ class ObsidianAPITester:
         self.tests_run = 0
         self.tests_passed = 0
         self.test_results = []
+        # Guards the counters and results list when tests run on worker threads
+        self._lock = threading.Lock()
+        # One keep-alive connection pool for every call instead of a new TCP+TLS handshake per test.
+        # With TESTS_CACHE set, repeated GETs within a few seconds are answered from memory
+        self.cached = bool(os.environ.get('TESTS_CACHE'))
+        if self.cached:
+            # Optional dependency, only needed when the cache is switched on
+            from requests_cache import CachedSession
+            self.session = CachedSession(backend='memory', expire_after=5, allowable_methods=('GET',), cache_control=True)
+        else:
+            self.session = requests.Session()
+        # Retry transient gateway errors and dropped connections with exponential backoff.
+        # POST is left out: a timed-out upload or query may already have run, so only a refused
+        # connection (which urllib3 retries for any method) is safe to resend
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=2,
+            backoff_factor=0.25,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "DELETE"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def set_token(self, token):
+        """Store the auth token and send it on every subsequent session request"""
+        self.token = token
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def load_cached_token(self, email):
+        """Adopt a cached, unexpired token for this host and email if the server still accepts it; returns True on success"""
+        try:
+            entry = orjson.loads(_TOKEN_CACHE_PATH.read_bytes())
+        except (OSError, ValueError):
+            return False
+        if entry.get('base_url') != self.base_url or entry.get('email') != email or entry.get('exp', 0) <= time.time() + 30:
+            return False
+        self.set_token(entry['token'])
+        self.user = entry['user']
+        # A reseeded DB or rotated JWT_SECRET rejects a token that has not expired yet
+        try:
+            response = self.session.get(f"{self.base_url}/auth/me", timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            response = None
+        if response is None or response.status_code == 401:
+            _TOKEN_CACHE_PATH.unlink(missing_ok=True)
+            self.token = self.user = None
+            self.session.headers.pop('Authorization', None)
+            return False
+        return True
+
+    def save_cached_token(self, email):
+        """Persist the current token with the expiry read from its JWT payload"""
+        payload = self.token.split('.')[1]
+        exp = orjson.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp']
+        body = orjson.dumps({
+            'base_url': self.base_url,
+            'email': email,
+            'token': self.token,
+            'user': self.user,
+            'exp': exp
+        })
+        # The file holds a live admin JWT: create it owner-only and tighten any older copy
+        fd = os.open(_TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(body)
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, headers=None):
-        """Run a single API test"""
+    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, headers=None, json_bytes=None, parse='full'):
+        """Run a single API test; parse='count' streams a JSON array and keeps only its length"""
         url = f"{self.base_url}/{endpoint}" if not endpoint.startswith('http') else endpoint
-        req_headers = {'Content-Type': 'application/json'}
-        if self.token:
-            req_headers['Authorization'] = f'Bearer {self.token}'
-        if headers:
-            req_headers.update(headers)
-
-        self.tests_run += 1
-        print(f"\n🔍 Testing {name}...")
+        # Content-Type and Authorization live on the session; only explicit overrides go per call
+        kwargs = {'headers': headers, 'timeout': REQUEST_TIMEOUT, 'stream': parse == 'count'}
+        if files:
+            # Drop the session's JSON Content-Type so requests sets the multipart boundary
+            kwargs['headers'] = {**headers, 'Content-Type': None} if headers else {'Content-Type': None}
+            kwargs['files'] = files
+            kwargs['data'] = data
+        elif json_bytes is not None or data is not None:
+            # JSON bodies are encoded with orjson; the session supplies the JSON Content-Type
+            kwargs['data'] = json_bytes if json_bytes is not None else orjson.dumps(data)
+
+        with self._lock:
+            self.tests_run += 1
+        logger.info("\n🔍 Testing %s...", name)
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=req_headers, timeout=30)
-            elif method == 'POST':
-                if files:
-                    # Remove Content-Type for multipart/form-data
-                    req_headers.pop('Content-Type', None)
-                    response = requests.post(url, files=files, data=data, headers=req_headers, timeout=30)
-                else:
-                    response = requests.post(url, json=data, headers=req_headers, timeout=30)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=req_headers, timeout=30)
-
-            success = response.status_code == expected_status
-            result = {
-                'name': name,
-                'method': method,
-                'endpoint': endpoint,
-                'expected_status': expected_status,
-                'actual_status': response.status_code,
-                'success': success,
-                'response_data': None,
-                'error': None
-            }
-
-            if success:
-                self.tests_passed += 1
-                print(f"✅ Passed - Status: {response.status_code}")
-                try:
-                    result['response_data'] = response.json()
-                except:
-                    result['response_data'] = response.text
-            else:
-                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
-                try:
-                    error_data = response.json()
-                    result['error'] = error_data
-                    print(f"   Error: {error_data}")
-                except:
-                    result['error'] = response.text
-                    print(f"   Error: {response.text}")
-
-            self.test_results.append(result)
-            return success, result.get('response_data', {})
+            response = self.session.request(method, url, **kwargs)
+
+            if method != 'GET' and self.cached:
+                # Writes can change any listing, so never serve a GET cached before one
+                self.session.cache.clear()
+
+            # Closing hands a streamed connection back to the pool even if the body is never read
+            with response:
+                success = response.status_code == expected_status
+                if response.status_code == 401 and expected_status != 401:
+                    # The cached token was rejected; force a fresh login next run
+                    _TOKEN_CACHE_PATH.unlink(missing_ok=True)
+                result = APITestResult(name, method, endpoint, expected_status, response.status_code, success)
+                # Decide JSON vs text from the header rather than by catching a failed parse
+                is_json = 'application/json' in response.headers.get('Content-Type', '')
+
+                if success and parse == 'count':
+                    # Count array items straight off the socket without building the list;
+                    # a response served from the GET cache already has its body in memory
+                    if getattr(response, 'from_cache', False):
+                        source = response.content
+                    else:
+                        response.raw.decode_content = True
+                        source = response.raw
+                    try:
+                        result.response_data = count_json_array(source)
+                    except (ijson.JSONError, ValueError) as e:
+                        success = result.success = False
+                        result.error = f"Unexpected body: {e}"
+                        logger.error("❌ %s failed - Status %s but %s", name, response.status_code, result.error)
+
+                body = None
+                if parse != 'count' or (not success and result.error is None):
+                    try:
+                        body = orjson.loads(response.content) if is_json else response.text
+                    except orjson.JSONDecodeError:
+                        # Empty or malformed body despite a JSON Content-Type
+                        body = response.text
+
+                if success:
+                    with self._lock:
+                        self.tests_passed += 1
+                    logger.info("✅ %s passed - Status: %s", name, response.status_code)
+                    if parse != 'count':
+                        result.response_data = body
+                elif result.error is None:
+                    result.error = body
+                    # One line per result: tests in the concurrent group interleave their output
+                    logger.error("❌ %s failed - Expected %s, got %s - Error: %s", name, expected_status, response.status_code, result.error)
+
+            with self._lock:
+                self.test_results.append(result)
+            return success, result.response_data
 
         except Exception as e:
-            print(f"❌ Failed - Exception: {str(e)}")
-            self.test_results.append({
-                'name': name,
-                'method': method,
-                'endpoint': endpoint,
-                'expected_status': expected_status,
-                'actual_status': 'Exception',
-                'success': False,
-                'response_data': None,
-                'error': str(e)
-            })
+            logger.error("❌ %s failed - Exception: %s", name, e)
+            with self._lock:
+                self.test_results.append(
+                    APITestResult(name, method, endpoint, expected_status, 'Exception', False, error=str(e))
+                )
             return False, {}
 
     def test_health_check(self):
@@ -102,14 +236,17 @@ class ObsidianAPITester:
             data={"username": username, "email": email, "password": password}
         )
         if success and 'token' in response:
-            self.token = response['token']
+            self.set_token(response['token'])
             self.user = response['user']
-            print(f"   Registered user: {self.user['username']} (role: {self.user['role']})")
+            logger.info("   Registered user: %s (role: %s)", self.user['username'], self.user['role'])
             return True
         return False
 
     def test_login(self, email, password):
         """Test user login"""
+        if self.load_cached_token(email):
+            logger.info("\n🔑 Reusing cached token for %s (role: %s)", self.user['username'], self.user['role'])
+            return True
         success, response = self.run_test(
             "User Login",
             "POST",
@@ -118,9 +255,10 @@ class ObsidianAPITester:
             data={"email": email, "password": password}
         )
         if success and 'token' in response:
-            self.token = response['token']
+            self.set_token(response['token'])
             self.user = response['user']
-            print(f"   Logged in as: {self.user['username']} (role: {self.user['role']})")
+            logger.info("   Logged in as: %s (role: %s)", self.user['username'], self.user['role'])
+            self.save_cached_token(email)
             return True
         return False
 
@@ -131,7 +269,7 @@ class ObsidianAPITester:
             "POST",
             "auth/login",
             401,
-            data={"email": "invalid@test.com", "password": "wrongpassword"}
+            json_bytes=_LOGIN_INVALID_BODY
         )
         return success
 
@@ -147,19 +285,17 @@ class ObsidianAPITester:
 
     def test_file_upload(self):
         """Test file upload with a sample PDF"""
-        # Create a small test PDF-like file
-        test_content = b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\nTest PDF content for RAG system"
-        files = {'file': ('test_document.pdf', test_content, 'application/pdf')}
-        
-        success, response = self.run_test(
-            "File Upload",
-            "POST",
-            "documents/upload",
-            200,
-            files=files
-        )
+        with open(_FIXTURE_PDF_PATH, 'rb') as fh:
+            files = {'file': ('test_document.pdf', fh, 'application/pdf')}
+            success, response = self.run_test(
+                "File Upload",
+                "POST",
+                "documents/upload",
+                200,
+                files=files
+            )
         if success and 'id' in response:
-            print(f"   Uploaded document ID: {response['id']}, chunks: {response.get('total_chunks', 0)}")
+            logger.info("   Uploaded document ID: %s, chunks: %s", response['id'], response.get('total_chunks', 0))
             return response['id']
         return None
 
@@ -169,10 +305,11 @@ class ObsidianAPITester:
             "List Documents",
             "GET",
             "documents",
-            200
+            200,
+            parse='count'
         )
-        if success and isinstance(response, list):
-            print(f"   Found {len(response)} documents")
+        if success:
+            logger.info("   Found %s documents", response)
         return success
 
     def test_query_system(self):
@@ -182,11 +319,11 @@ class ObsidianAPITester:
             "POST",
             "query",
             200,
-            data={"query": "What information is available in the uploaded documents?", "top_k": 5}
+            json_bytes=_QUERY_BODY
         )
         if success:
-            print(f"   Answer: {response.get('answer', '')[:100]}...")
-            print(f"   Citations: {len(response.get('citations', []))}")
+            logger.info("   Answer: %s...", response.get('answer', '')[:100])
+            logger.info("   Citations: %s", len(response.get('citations', [])))
             return response.get('query_id')
         return None
 
@@ -196,10 +333,11 @@ class ObsidianAPITester:
             "Query History",
             "GET",
             "query/history",
-            200
+            200,
+            parse='count'
         )
-        if success and isinstance(response, list):
-            print(f"   Found {len(response)} queries in history")
+        if success:
+            logger.info("   Found %s queries in history", response)
         return success
 
     def test_analytics_stats(self):
@@ -212,32 +350,33 @@ class ObsidianAPITester:
         )
         if success:
             stats = response
-            print(f"   Documents: {stats.get('total_documents', 0)}")
-            print(f"   Chunks: {stats.get('total_chunks', 0)}")
-            print(f"   Queries: {stats.get('total_queries', 0)}")
-            print(f"   Users: {stats.get('total_users', 0)}")
+            logger.info("   Documents: %s", stats.get('total_documents', 0))
+            logger.info("   Chunks: %s", stats.get('total_chunks', 0))
+            logger.info("   Queries: %s", stats.get('total_queries', 0))
+            logger.info("   Users: %s", stats.get('total_users', 0))
         return success
 
     def test_admin_audit_logs(self):
         """Test admin audit logs (admin only)"""
         if self.user and self.user.get('role') != 'admin':
-            print("   Skipping admin test - not admin user")
+            logger.info("   Skipping admin test - not admin user")
             return True
         
         success, response = self.run_test(
             "Admin Audit Logs",
             "GET",
             "admin/audit-logs",
-            200
+            200,
+            parse='count'
         )
-        if success and isinstance(response, list):
-            print(f"   Found {len(response)} audit log entries")
+        if success:
+            logger.info("   Found %s audit log entries", response)
         return success
 
     def test_admin_rebuild_index(self):
         """Test admin rebuild index (admin only)"""
         if self.user and self.user.get('role') != 'admin':
-            print("   Skipping admin test - not admin user")
+            logger.info("   Skipping admin test - not admin user")
             return True
         
         success, response = self.run_test(
@@ -247,29 +386,30 @@ class ObsidianAPITester:
             200
         )
         if success:
-            print(f"   Index rebuild result: {response.get('message', 'Success')}")
+            logger.info("   Index rebuild result: %s", response.get('message', 'Success'))
         return success
 
     def test_admin_users(self):
         """Test admin users list (admin only)"""
         if self.user and self.user.get('role') != 'admin':
-            print("   Skipping admin test - not admin user")
+            logger.info("   Skipping admin test - not admin user")
             return True
         
         success, response = self.run_test(
             "Admin Users List",
             "GET",
             "admin/users",
-            200
+            200,
+            parse='count'
         )
-        if success and isinstance(response, list):
-            print(f"   Found {len(response)} users")
+        if success:
+            logger.info("   Found %s users", response)
         return success
 
     def test_delete_document(self, doc_id):
         """Test document deletion"""
         if not doc_id:
-            print("   Skipping delete test - no document ID")
+            logger.info("   Skipping delete test - no document ID")
             return True
         
         success, response = self.run_test(
@@ -281,8 +421,8 @@ class ObsidianAPITester:
         return success
 
 def main():
-    print("🚀 Starting Project Obsidian API Tests")
-    print("=" * 50)
+    logger.info("🚀 Starting Project Obsidian API Tests")
+    logger.info("=" * 50)
     
     tester = ObsidianAPITester()
     
@@ -291,58 +431,67 @@ def main():
     
     # 1. Health check
     if not tester.test_health_check():
-        print("❌ Health check failed, stopping tests")
+        logger.error("❌ Health check failed, stopping tests")
+        tester.session.close()
+        logger.handlers[0].flush()
         return 1
     
     # 2. Test with existing admin user
     if not tester.test_login("admin@obsidian.sec", "admin123"):
-        print("❌ Admin login failed, stopping tests")
+        logger.error("❌ Admin login failed, stopping tests")
+        tester.session.close()
+        logger.handlers[0].flush()
         return 1
     
-    # 3. Test invalid login
-    tester.test_invalid_login()
-    
-    # 4. Test current user info
-    tester.test_get_me()
-    
-    # 5. Test file operations
+    # 3. Test file operations
     doc_id = tester.test_file_upload()
-    tester.test_list_documents()
     
-    # 6. Test query system
+    # 4. Test query system
     tester.test_query_system()
-    tester.test_query_history()
     
-    # 7. Test analytics
-    tester.test_analytics_stats()
+    # 5. Invalid login, current user info, listings, analytics and admin views don't change
+    # state or depend on each other, so overlap their round-trips
+    read_only_tests = (
+        tester.test_invalid_login,
+        tester.test_get_me,
+        tester.test_list_documents,
+        tester.test_query_history,
+        tester.test_analytics_stats,
+        tester.test_admin_audit_logs,
+        tester.test_admin_users,
+    )
+    with ThreadPoolExecutor(max_workers=len(read_only_tests)) as executor:
+        futures = [executor.submit(test) for test in read_only_tests]
+        for future in futures:
+            future.result()
     
-    # 8. Test admin functions
-    tester.test_admin_audit_logs()
+    # 6. Test admin functions
     tester.test_admin_rebuild_index()
-    tester.test_admin_users()
     
-    # 9. Clean up - delete test document
+    # 7. Clean up - delete test document
     if doc_id:
         tester.test_delete_document(doc_id)
     
     # Print results
-    print(f"\n📊 Test Results:")
-    print(f"Tests passed: {tester.tests_passed}/{tester.tests_run}")
-    print(f"Success rate: {(tester.tests_passed/tester.tests_run*100):.1f}%")
+    logger.info("\n📊 Test Results:")
+    logger.info("Tests passed: %s/%s", tester.tests_passed, tester.tests_run)
+    logger.info("Success rate: %.1f%%", tester.tests_passed/tester.tests_run*100)
     
     # Save detailed results
     results_file = "/app/test_reports/backend_test_results.json"
     Path("/app/test_reports").mkdir(exist_ok=True)
-    with open(results_file, 'w') as f:
-        json.dump({
-            'timestamp': datetime.now().isoformat(),
-            'total_tests': tester.tests_run,
-            'passed_tests': tester.tests_passed,
-            'success_rate': tester.tests_passed/tester.tests_run*100 if tester.tests_run > 0 else 0,
-            'detailed_results': tester.test_results
-        }, f, indent=2)
+    # orjson serialises the APITestResult dataclasses natively and emits the file in one write
+    Path(results_file).write_bytes(orjson.dumps({
+        'timestamp': datetime.now().isoformat(),
+        'total_tests': tester.tests_run,
+        'passed_tests': tester.tests_passed,
+        'success_rate': tester.tests_passed/tester.tests_run*100 if tester.tests_run > 0 else 0,
+        'detailed_results': tester.test_results
+    }, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_DATACLASS, default=str))
     
-    print(f"Detailed results saved to: {results_file}")
+    logger.info("Detailed results saved to: %s", results_file)
+    tester.session.close()
+    logger.handlers[0].flush()
     
     return 0 if tester.tests_passed == tester.tests_run else 1
 